@@ -2,17 +2,29 @@
 GFS Ordering Blueprint for Kinawa Command Center
 """
 from flask import Blueprint, render_template, request, jsonify, current_app
+import importlib.util
 import json
 import sys
 from pathlib import Path
-from datetime import datetime, timedelta
-
-# Add scripts path for imports
-scripts_path = Path(__file__).parent / 'scripts'
-if str(scripts_path) not in sys.path:
-    sys.path.insert(0, str(scripts_path))
-
-from db_manager import DatabaseManager
+from datetime import date, timedelta
+
+if __package__:
+    from .scripts.db_manager import DatabaseManager
+else:
+    # Loaded as a top-level module or by file path (the checkout directory,
+    # gfs-ordering, isn't importable as a package). Load db_manager from its
+    # file under a unique name so neither sys.path order nor the host app's
+    # own "scripts" package can change which module we get.
+    _db_module = sys.modules.get('gfs_ordering_db_manager')
+    if _db_module is None:
+        _spec = importlib.util.spec_from_file_location(
+            'gfs_ordering_db_manager',
+            Path(__file__).parent / 'scripts' / 'db_manager.py'
+        )
+        _db_module = importlib.util.module_from_spec(_spec)
+        sys.modules[_spec.name] = _db_module
+        _spec.loader.exec_module(_db_module)
+    DatabaseManager = _db_module.DatabaseManager
 
 gfs_bp = Blueprint('gfs_ordering', __name__, 
                    template_folder='templates',
@@ -20,8 +32,48 @@ gfs_bp = Blueprint('gfs_ordering', __name__,
 
 DB_PATH = Path(__file__).parent / 'data' / 'gfs_catalog.db'
 
+_db = None
+
+# GET endpoints whose responses change rarely enough for the browser to
+# reuse them briefly; everything else is revalidated against its ETag
+BROWSER_CACHEABLE = {'gfs_ordering.api_programs'}
+BROWSER_MAX_AGE = 30
+
 def get_db():
-    return DatabaseManager(DB_PATH)
+    """Shared DatabaseManager; it keeps one connection per worker thread"""
+    global _db
+    if _db is None:
+        _db = DatabaseManager(DB_PATH)
+    return _db
+
+# (day computed on, 'YYYY-MM-DD') of the last suggested delivery date
+_suggested_date = (None, None)
+
+def get_suggested_date():
+    """Suggested delivery date (next Tuesday), computed once per day"""
+    global _suggested_date
+    today = date.today()
+    if _suggested_date[0] != today:
+        days_until_tuesday = (1 - today.weekday()) % 7  # 1 = Tuesday
+        if days_until_tuesday == 0:
+            days_until_tuesday = 7
+        _suggested_date = (today, (today + timedelta(days=days_until_tuesday)).isoformat())
+    return _suggested_date[1]
+
+@gfs_bp.after_request
+def add_cache_headers(response):
+    """ETag GET responses so unchanged pages come back as 304s"""
+    if request.method != 'GET' or response.status_code != 200 or response.is_streamed:
+        return response
+    
+    response.cache_control.private = True
+    if request.endpoint in BROWSER_CACHEABLE:
+        response.cache_control.max_age = BROWSER_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+    
+    response.add_etag()
+    return response.make_conditional(request)
 
 @gfs_bp.route('/')
 def index():
@@ -29,16 +81,9 @@ def index():
     db = get_db()
     
     # Get stats
-    categories = db.get_products_by_category()
-    recent_orders = db.get_orders(limit=5)
-    frequent_products = db.get_frequently_ordered(limit=10)
-    programs = db.get_programs()
+    payload = db.get_dashboard_payload(recent_limit=5, frequent_limit=10)
     
-    return render_template('gfs_ordering.html',
-                         categories=categories,
-                         recent_orders=recent_orders,
-                         frequent_products=frequent_products,
-                         programs=programs)
+    return render_template('gfs_ordering.html', **payload)
 
 @gfs_bp.route('/products')
 def products():
@@ -51,6 +96,10 @@ def products():
     products = db.search_products(query=query, category=category, limit=100)
     categories = db.get_products_by_category()
     
+    histories = db.get_price_histories(p['id'] for p in products)
+    for p in products:
+        p['price_history'] = histories.get(p['id'], [])
+    
     return render_template('gfs_products.html',
                          products=products,
                          categories=categories,
@@ -66,6 +115,7 @@ def product_detail(product_id):
     if not product:
         return jsonify({'error': 'Product not found'}), 404
     
+    product['price_history'] = db.get_price_history(product_id)
     return jsonify(product)
 
 @gfs_bp.route('/orders')
@@ -97,17 +147,10 @@ def new_order():
     programs = db.get_programs()
     frequent = db.get_frequently_ordered(limit=20)
     
-    # Calculate suggested delivery date (next Tuesday)
-    today = datetime.now()
-    days_until_tuesday = (1 - today.weekday()) % 7  # 1 = Tuesday
-    if days_until_tuesday == 0:
-        days_until_tuesday = 7
-    suggested_date = (today + timedelta(days=days_until_tuesday)).strftime('%Y-%m-%d')
-    
     return render_template('gfs_new_order.html',
                          programs=programs,
                          frequent_products=frequent,
-                         suggested_date=suggested_date)
+                         suggested_date=get_suggested_date())
 
 @gfs_bp.route('/orders/<int:order_id>')
 def order_detail(order_id):
@@ -51,6 +51,7 @@ CREATE TABLE IF NOT EXISTS gfs_order_items (
     order_id INTEGER NOT NULL,
     product_id INTEGER NOT NULL,
     quantity INTEGER NOT NULL DEFAULT 1,
+    unit_price DECIMAL(10,2),                 -- product price when the item was added
     programs TEXT,                            -- JSON: ["kinawa", "cornell"] - which programs this item is for
     is_gsrp BOOLEAN DEFAULT 0,                -- legacy flag, use programs array now
     notes TEXT,
@@ -84,12 +85,76 @@ CREATE TABLE IF NOT EXISTS gfs_invoice_items (
     FOREIGN KEY (product_id) REFERENCES gfs_products(id)
 );
 
+-- Price points per product, appended when an invoice shows a new price
+-- (replaces the legacy gfs_products.price_history JSON column)
+CREATE TABLE IF NOT EXISTS gfs_price_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    date DATE,
+    price DECIMAL(10,2),
+    FOREIGN KEY (product_id) REFERENCES gfs_products(id)
+);
+
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_products_code ON gfs_products(gfs_item_code);
 CREATE INDEX IF NOT EXISTS idx_products_category ON gfs_products(category_code);
 CREATE INDEX IF NOT EXISTS idx_products_active ON gfs_products(is_active);
+CREATE INDEX IF NOT EXISTS idx_products_active_order ON gfs_products(is_active, order_count DESC, description);
 CREATE INDEX IF NOT EXISTS idx_order_items_order ON gfs_order_items(order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON gfs_orders(created_date DESC);
+CREATE INDEX IF NOT EXISTS idx_orders_status_created ON gfs_orders(status, created_date DESC);
 CREATE INDEX IF NOT EXISTS idx_invoice_history_date ON gfs_invoice_history(invoice_date);
+CREATE INDEX IF NOT EXISTS idx_price_history_product ON gfs_price_history(product_id, id);
+
+-- Full-text index over the product catalog (kept in sync by triggers)
+CREATE VIRTUAL TABLE IF NOT EXISTS gfs_products_fts USING fts5(
+    description, brand, gfs_item_code,
+    content='gfs_products', content_rowid='id'
+);
+
+CREATE TRIGGER IF NOT EXISTS gfs_products_fts_ai AFTER INSERT ON gfs_products BEGIN
+    INSERT INTO gfs_products_fts (rowid, description, brand, gfs_item_code)
+    VALUES (new.id, new.description, new.brand, new.gfs_item_code);
+END;
+
+CREATE TRIGGER IF NOT EXISTS gfs_products_fts_ad AFTER DELETE ON gfs_products BEGIN
+    INSERT INTO gfs_products_fts (gfs_products_fts, rowid, description, brand, gfs_item_code)
+    VALUES ('delete', old.id, old.description, old.brand, old.gfs_item_code);
+END;
+
+-- Only the indexed columns; price/count updates don't touch the index
+CREATE TRIGGER IF NOT EXISTS gfs_products_fts_au
+AFTER UPDATE OF description, brand, gfs_item_code ON gfs_products BEGIN
+    INSERT INTO gfs_products_fts (gfs_products_fts, rowid, description, brand, gfs_item_code)
+    VALUES ('delete', old.id, old.description, old.brand, old.gfs_item_code);
+    INSERT INTO gfs_products_fts (rowid, description, brand, gfs_item_code)
+    VALUES (new.id, new.description, new.brand, new.gfs_item_code);
+END;
+
+-- Keep gfs_orders.total_estimate equal to SUM(quantity * unit_price) of its items
+CREATE TRIGGER IF NOT EXISTS gfs_order_items_total_ai AFTER INSERT ON gfs_order_items BEGIN
+    UPDATE gfs_orders SET total_estimate = ROUND(COALESCE(total_estimate, 0)
+        + NEW.quantity * COALESCE(NEW.unit_price, 0), 2)
+    WHERE id = NEW.order_id;
+END;
+CREATE TRIGGER IF NOT EXISTS gfs_order_items_total_ad AFTER DELETE ON gfs_order_items BEGIN
+    UPDATE gfs_orders SET total_estimate = ROUND(COALESCE(total_estimate, 0)
+        - OLD.quantity * COALESCE(OLD.unit_price, 0), 2)
+    WHERE id = OLD.order_id;
+END;
+CREATE TRIGGER IF NOT EXISTS gfs_order_items_total_au
+AFTER UPDATE OF quantity, unit_price, order_id ON gfs_order_items
+WHEN OLD.quantity IS NOT NEW.quantity
+    OR OLD.unit_price IS NOT NEW.unit_price
+    OR OLD.order_id IS NOT NEW.order_id
+BEGIN
+    UPDATE gfs_orders SET total_estimate = ROUND(COALESCE(total_estimate, 0)
+        - OLD.quantity * COALESCE(OLD.unit_price, 0), 2)
+    WHERE id = OLD.order_id;
+    UPDATE gfs_orders SET total_estimate = ROUND(COALESCE(total_estimate, 0)
+        + NEW.quantity * COALESCE(NEW.unit_price, 0), 2)
+    WHERE id = NEW.order_id;
+END;
 
 -- Insert default programs
 INSERT OR IGNORE INTO gfs_programs (name, short_code, category, color) VALUES
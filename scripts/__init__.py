@@ -0,0 +1,3 @@
+"""
+GFS Ordering scripts: database manager and invoice parser
+"""
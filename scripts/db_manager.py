@@ -5,37 +5,210 @@ Handles all SQLite operations
 """
 import sqlite3
 import json
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime, date
 from pathlib import Path
 
+# SQLite caps bound parameters per statement (999 on older builds)
+SQLITE_MAX_PARAMS = 900
+
+# Prepared statements kept per connection, keyed by SQL text. Sized so the
+# variable IN (...) lists of bulk operations don't evict the fixed queries.
+STATEMENT_CACHE_SIZE = 256
+
+# Applied once to every new connection
+CONNECTION_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA cache_size=-20000;
+"""
+
+# Search terms that can be passed to FTS5 as quoted prefix tokens
+FTS_QUERY_RE = re.compile(r'[\w\s]+')
+
+# gfs_products columns returned by reads. Leaves out the legacy price_history
+# JSON, which is no longer written; use get_price_histories() instead.
+PRODUCT_COLUMNS = """
+    id, gfs_item_code, description, brand, pack_size, category_code,
+    category_name, unit_price, first_seen, last_seen, order_count,
+    preferred_programs, tags, is_active
+"""
+
+# Seconds a cached read stays valid if no write bumps the version first
+CACHE_TTL = 60
+
+def chunked(seq, size):
+    """Yield successive slices of seq with at most size elements"""
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
 class DatabaseManager:
     def __init__(self, db_path):
         self.db_path = db_path
+        self._local = threading.local()
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self._version = 0
         self.init_database()
     
     def get_connection(self):
-        """Get database connection with row factory"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        """Get this thread's long-lived database connection
+        
+        Connections run in autocommit mode; multi-statement writes use
+        transaction() for an explicit BEGIN/COMMIT.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None,
+                                   check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row
+            conn.executescript(CONNECTION_PRAGMAS)
+            self._local.conn = conn
         return conn
     
+    @contextmanager
+    def transaction(self, conn=None):
+        """Run a block of writes in one transaction on this thread's connection
+        
+        A block nested inside another transaction() on the same connection
+        runs in a savepoint: its writes are undone if it raises, and the
+        commit is left to the outer block. Write methods take an optional
+        conn for this.
+        """
+        if conn is None:
+            conn = self.get_connection()
+        depth = getattr(self._local, 'depth', None)
+        if depth is None:
+            depth = self._local.depth = {}
+        if depth.get(conn):
+            savepoint = f"sp_{depth[conn]}"
+            conn.execute(f"SAVEPOINT {savepoint}")
+            depth[conn] += 1
+            try:
+                yield conn
+                conn.execute(f"RELEASE {savepoint}")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    conn.execute(f"RELEASE {savepoint}")
+                raise
+            finally:
+                depth[conn] -= 1
+            return
+        
+        conn.execute("BEGIN IMMEDIATE")
+        depth[conn] = 1
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            # SQLite may already have rolled back (e.g. INSERT OR ROLLBACK)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            del depth[conn]
+            self._invalidate_cache()
+    
+    def _invalidate_cache(self):
+        """Drop cached reads after a write"""
+        with self._cache_lock:
+            self._version += 1
+            self._cache.clear()
+    
+    def _cached(self, key, compute):
+        """Return compute() for key, reusing a result younger than CACHE_TTL
+        
+        Results are lists of dicts; callers get fresh copies so they can
+        modify them without touching the cache.
+        """
+        now = time.monotonic()
+        with self._cache_lock:
+            version = self._version
+            entry = self._cache.get(key)
+        if entry is None or now - entry[0] >= CACHE_TTL:
+            entry = (now, compute())
+            with self._cache_lock:
+                # Don't store a result that raced with a write
+                if self._version == version:
+                    self._cache[key] = entry
+        return [dict(row) for row in entry[1]]
+    
     def init_database(self):
-        """Initialize database with schema"""
+        """Initialize database with schema
+        
+        Runs on a one-shot connection so the schema exists before any
+        thread opens its long-lived connection.
+        """
         schema_path = Path(__file__).parent.parent / 'schema.sql'
         
-        with self.get_connection() as conn:
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            cursor = conn.execute("SELECT name FROM sqlite_master")
+            existing = {row[0] for row in cursor}
+            
+            # Order items store the price they were added at, which the
+            # order total triggers add and subtract. Older databases lack
+            # it: price their items at current product prices, recompute
+            # those orders' totals once, and drop any total triggers from
+            # before the column so the schema recreates them.
+            if 'gfs_order_items' in existing:
+                with self.transaction(conn):
+                    cursor = conn.execute("PRAGMA table_info(gfs_order_items)")
+                    if 'unit_price' not in {row[1] for row in cursor}:
+                        for trigger in ('ai', 'ad', 'au'):
+                            conn.execute(f"DROP TRIGGER IF EXISTS gfs_order_items_total_{trigger}")
+                        conn.execute("ALTER TABLE gfs_order_items ADD COLUMN unit_price DECIMAL(10,2)")
+                        conn.execute("""
+                            UPDATE gfs_order_items SET unit_price = (
+                                SELECT unit_price FROM gfs_products WHERE id = product_id
+                            )
+                        """)
+                        conn.execute("""
+                            UPDATE gfs_orders SET total_estimate = (
+                                SELECT ROUND(COALESCE(SUM(quantity * unit_price), 0), 2)
+                                FROM gfs_order_items WHERE order_id = gfs_orders.id
+                            )
+                            WHERE id IN (SELECT order_id FROM gfs_order_items)
+                        """)
+            
             if schema_path.exists():
                 with open(schema_path) as f:
                     conn.executescript(f.read())
-            conn.commit()
+            
+            # Index products that existed before the FTS table was added
+            if 'gfs_products_fts' not in existing:
+                conn.execute(
+                    "INSERT INTO gfs_products_fts (gfs_products_fts) VALUES ('rebuild')"
+                )
+            
+            # Carry over the legacy JSON price history into its own table.
+            # Checked under the write lock so concurrent startups copy it once.
+            with self.transaction(conn):
+                if conn.execute("SELECT 1 FROM gfs_price_history LIMIT 1").fetchone() is None:
+                    conn.execute("""
+                        INSERT INTO gfs_price_history (product_id, date, price)
+                        SELECT p.id, json_extract(h.value, '$.date'), json_extract(h.value, '$.price')
+                        FROM gfs_products p, json_each(p.price_history) h
+                        WHERE json_valid(p.price_history)
+                        ORDER BY p.id, h.key
+                    """)
+        finally:
+            conn.close()
     
     # Product Operations
-    def upsert_product(self, item_data):
+    def upsert_product(self, item_data, conn=None):
         """Add or update a product from invoice data"""
-        with self.get_connection() as conn:
+        with self.transaction(conn) as conn:
             # Check if product exists
             cursor = conn.execute(
-                "SELECT id, price_history, order_count FROM gfs_products WHERE gfs_item_code = ?",
+                "SELECT id FROM gfs_products WHERE gfs_item_code = ?",
                 (item_data['item_code'],)
             )
             existing = cursor.fetchone()
@@ -45,28 +218,15 @@ class DatabaseManager:
             if existing:
                 # Update existing product
                 product_id = existing['id']
-                price_history = json.loads(existing['price_history'] or '[]')
-                order_count = existing['order_count'] + 1
-                
-                # Add new price point if different from last
-                if not price_history or price_history[-1]['price'] != item_data['unit_price']:
-                    price_history.append({
-                        'date': today,
-                        'price': item_data['unit_price']
-                    })
-                
                 conn.execute("""
                     UPDATE gfs_products SET
                         unit_price = ?,
-                        price_history = ?,
                         last_seen = ?,
-                        order_count = ?
+                        order_count = order_count + 1
                     WHERE id = ?
                 """, (
                     item_data['unit_price'],
-                    json.dumps(price_history),
                     today,
-                    order_count,
                     product_id
                 ))
             else:
@@ -75,8 +235,8 @@ class DatabaseManager:
                     INSERT INTO gfs_products (
                         gfs_item_code, description, brand, pack_size,
                         category_code, category_name, unit_price,
-                        price_history, first_seen, last_seen, order_count
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        first_seen, last_seen, order_count
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     item_data['item_code'],
                     item_data.get('description', ''),
@@ -85,232 +245,378 @@ class DatabaseManager:
                     item_data.get('category_code', ''),
                     item_data.get('category_name', ''),
                     item_data['unit_price'],
-                    json.dumps([{'date': today, 'price': item_data['unit_price']}]),
                     today,
                     today,
                     1
                 ))
                 product_id = cursor.lastrowid
             
-            conn.commit()
+            # Add new price point if different from last
+            conn.execute("""
+                INSERT INTO gfs_price_history (product_id, date, price)
+                SELECT ?, ?, ?
+                WHERE (
+                    SELECT price FROM gfs_price_history
+                    WHERE product_id = ? ORDER BY id DESC LIMIT 1
+                ) IS NOT ?
+            """, (
+                product_id,
+                today,
+                item_data['unit_price'],
+                product_id,
+                item_data['unit_price']
+            ))
+            
             return product_id
     
+    def bulk_upsert_products(self, items, conn=None):
+        """Add or update all products from an invoice's line items
+        
+        Same semantics as calling upsert_product once per item, but existing
+        products are fetched with one IN query per chunk and writes are done
+        with executemany. Returns a dict mapping item_code -> product_id.
+        """
+        with self.transaction(conn) as conn:
+            today = date.today().isoformat()
+            codes = list(dict.fromkeys(item['item_code'] for item in items))
+            
+            # Pre-fetch existing products with their latest price point
+            existing = self.get_products_by_codes(codes, conn)
+            last_prices = self._get_last_prices([p['id'] for p in existing.values()], conn)
+            products = {
+                code: {
+                    'id': p['id'],
+                    'last_price': last_prices.get(p['id']),
+                    'order_count': p['order_count'],
+                }
+                for code, p in existing.items()
+            }
+            
+            # Apply items in order so repeated codes behave like repeated upserts
+            new_products = {}
+            price_points = []
+            for item in items:
+                code = item['item_code']
+                product = products.get(code)
+                if product is None:
+                    product = {
+                        'id': None,
+                        'item': item,
+                        'last_price': None,
+                        'order_count': 0,
+                    }
+                    products[code] = new_products[code] = product
+                
+                if product['last_price'] != item['unit_price']:
+                    product['last_price'] = item['unit_price']
+                    price_points.append((code, item['unit_price']))
+                product['unit_price'] = item['unit_price']
+                product['order_count'] += 1
+            
+            if new_products:
+                conn.executemany("""
+                    INSERT INTO gfs_products (
+                        gfs_item_code, description, brand, pack_size,
+                        category_code, category_name, unit_price,
+                        first_seen, last_seen, order_count
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (
+                        code,
+                        p['item'].get('description', ''),
+                        p['item'].get('brand', ''),
+                        p['item'].get('pack_size', ''),
+                        p['item'].get('category_code', ''),
+                        p['item'].get('category_name', ''),
+                        p['unit_price'],
+                        today,
+                        today,
+                        p['order_count']
+                    )
+                    for code, p in new_products.items()
+                ])
+                
+                for code, p in self.get_products_by_codes(list(new_products), conn).items():
+                    products[code]['id'] = p['id']
+            
+            updates = [
+                (p['unit_price'], today, p['order_count'], p['id'])
+                for code, p in products.items()
+                if code not in new_products
+            ]
+            if updates:
+                conn.executemany("""
+                    UPDATE gfs_products SET
+                        unit_price = ?,
+                        last_seen = ?,
+                        order_count = ?
+                    WHERE id = ?
+                """, updates)
+            
+            if price_points:
+                conn.executemany(
+                    "INSERT INTO gfs_price_history (product_id, date, price) VALUES (?, ?, ?)",
+                    [(products[code]['id'], today, price) for code, price in price_points]
+                )
+            
+            return {code: p['id'] for code, p in products.items()}
+    
+    def _get_last_prices(self, product_ids, conn=None):
+        """Get each product's latest price point as product_id -> price"""
+        if conn is None:
+            conn = self.get_connection()
+        prices = {}
+        for chunk in chunked(product_ids, SQLITE_MAX_PARAMS):
+            placeholders = ','.join('?' * len(chunk))
+            cursor = conn.execute(f"""
+                SELECT product_id, price FROM gfs_price_history
+                WHERE id IN (
+                    SELECT MAX(id) FROM gfs_price_history
+                    WHERE product_id IN ({placeholders})
+                    GROUP BY product_id
+                )
+            """, chunk)
+            for row in cursor:
+                prices[row['product_id']] = row['price']
+        return prices
+    
+    def get_price_history(self, product_id):
+        """Get a product's price points, oldest first"""
+        return self.get_price_histories([product_id]).get(product_id, [])
+    
+    def get_price_histories(self, product_ids):
+        """Get price points for several products as product_id -> list"""
+        conn = self.get_connection()
+        histories = {}
+        for chunk in chunked(list(product_ids), SQLITE_MAX_PARAMS):
+            placeholders = ','.join('?' * len(chunk))
+            cursor = conn.execute(f"""
+                SELECT product_id, date, price FROM gfs_price_history
+                WHERE product_id IN ({placeholders})
+                ORDER BY product_id, id
+            """, chunk)
+            for row in cursor:
+                histories.setdefault(row['product_id'], []).append(
+                    {'date': row['date'], 'price': row['price']}
+                )
+        return histories
+    
     def get_product(self, product_id):
         """Get a single product by ID"""
-        with self.get_connection() as conn:
-            cursor = conn.execute(
-                "SELECT * FROM gfs_products WHERE id = ?",
-                (product_id,)
-            )
-            row = cursor.fetchone()
-            return dict(row) if row else None
+        conn = self.get_connection()
+        cursor = conn.execute(
+            f"SELECT {PRODUCT_COLUMNS} FROM gfs_products WHERE id = ?",
+            (product_id,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
     
     def get_product_by_code(self, item_code):
         """Get a product by GFS item code"""
-        with self.get_connection() as conn:
+        conn = self.get_connection()
+        cursor = conn.execute(
+            f"SELECT {PRODUCT_COLUMNS} FROM gfs_products WHERE gfs_item_code = ?",
+            (item_code,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+    
+    def get_products_by_codes(self, item_codes, conn=None):
+        """Get products for many GFS item codes as item_code -> product
+        
+        One IN query per SQLITE_MAX_PARAMS codes instead of one
+        get_product_by_code call per code; unknown codes are left out.
+        """
+        if conn is None:
+            conn = self.get_connection()
+        products = {}
+        for chunk in chunked(list(item_codes), SQLITE_MAX_PARAMS):
+            placeholders = ','.join('?' * len(chunk))
             cursor = conn.execute(
-                "SELECT * FROM gfs_products WHERE gfs_item_code = ?",
-                (item_code,)
+                f"SELECT {PRODUCT_COLUMNS} FROM gfs_products WHERE gfs_item_code IN ({placeholders})",
+                chunk
             )
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            for row in cursor:
+                products[row['gfs_item_code']] = dict(row)
+        return products
     
     def search_products(self, query=None, category=None, limit=50):
         """Search products with filters"""
-        with self.get_connection() as conn:
-            sql = "SELECT * FROM gfs_products WHERE is_active = 1"
-            params = []
-            
+        conn = self.get_connection()
+        params = []
+        
+        if query and FTS_QUERY_RE.fullmatch(query) and query.strip():
+            # Prefix match on every word, e.g. "gran app" -> "gran"* "app"*
+            sql = f"""
+                SELECT {PRODUCT_COLUMNS} FROM gfs_products p
+                WHERE p.id IN (
+                    SELECT rowid FROM gfs_products_fts WHERE gfs_products_fts MATCH ?
+                ) AND p.is_active = 1
+            """
+            params.append(' '.join(f'"{word}"*' for word in query.split()))
+        else:
+            sql = f"SELECT {PRODUCT_COLUMNS} FROM gfs_products p WHERE p.is_active = 1"
             if query:
-                sql += " AND (description LIKE ? OR brand LIKE ? OR gfs_item_code LIKE ?)"
+                # Punctuation isn't indexed by FTS, fall back to a substring scan
+                sql += " AND (p.description LIKE ? OR p.brand LIKE ? OR p.gfs_item_code LIKE ?)"
                 like_query = f"%{query}%"
                 params.extend([like_query, like_query, like_query])
-            
-            if category:
-                sql += " AND category_code = ?"
-                params.append(category)
-            
-            sql += " ORDER BY order_count DESC, description LIMIT ?"
-            params.append(limit)
-            
-            cursor = conn.execute(sql, params)
-            return [dict(row) for row in cursor.fetchall()]
+        
+        if category:
+            sql += " AND p.category_code = ?"
+            params.append(category)
+        
+        sql += " ORDER BY p.order_count DESC, p.description LIMIT ?"
+        params.append(limit)
+        
+        cursor = conn.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
     
     def get_products_by_category(self):
         """Get products grouped by category"""
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                SELECT category_code, category_name, COUNT(*) as count,
-                       AVG(unit_price) as avg_price
-                FROM gfs_products
-                WHERE is_active = 1
-                GROUP BY category_code
-                ORDER BY count DESC
-            """)
-            return [dict(row) for row in cursor.fetchall()]
+        return self._cached(('get_products_by_category',), self._get_products_by_category)
+    
+    def _get_products_by_category(self):
+        conn = self.get_connection()
+        cursor = conn.execute("""
+            SELECT category_code, category_name, COUNT(*) as count,
+                   AVG(unit_price) as avg_price
+            FROM gfs_products
+            WHERE is_active = 1
+            GROUP BY category_code
+            ORDER BY count DESC
+        """)
+        return [dict(row) for row in cursor.fetchall()]
     
     def get_frequently_ordered(self, limit=20):
         """Get most frequently ordered products"""
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                SELECT * FROM gfs_products
-                WHERE is_active = 1
-                ORDER BY order_count DESC, last_seen DESC
-                LIMIT ?
-            """, (limit,))
-            return [dict(row) for row in cursor.fetchall()]
+        conn = self.get_connection()
+        cursor = conn.execute(f"""
+            SELECT {PRODUCT_COLUMNS} FROM gfs_products
+            WHERE is_active = 1
+            ORDER BY order_count DESC, last_seen DESC
+            LIMIT ?
+        """, (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def get_dashboard_payload(self, recent_limit=5, frequent_limit=10):
+        """Get everything the dashboard renders
+        
+        Categories and programs come from the read cache; all four reads
+        share this thread's connection.
+        """
+        return {
+            'categories': self.get_products_by_category(),
+            'recent_orders': self.get_orders(limit=recent_limit),
+            'frequent_products': self.get_frequently_ordered(limit=frequent_limit),
+            'programs': self.get_programs()
+        }
     
     # Order Operations
-    def create_order(self, name, delivery_date=None, notes=None):
+    def create_order(self, name, delivery_date=None, notes=None, conn=None):
         """Create a new order"""
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                INSERT INTO gfs_orders (name, delivery_date, notes, status)
-                VALUES (?, ?, ?, 'draft')
-            """, (name, delivery_date, notes))
-            conn.commit()
-            return cursor.lastrowid
+        if conn is None:
+            conn = self.get_connection()
+        cursor = conn.execute("""
+            INSERT INTO gfs_orders (name, delivery_date, notes, status)
+            VALUES (?, ?, ?, 'draft')
+        """, (name, delivery_date, notes))
+        return cursor.lastrowid
     
     def get_order(self, order_id):
         """Get order with all items"""
-        with self.get_connection() as conn:
-            cursor = conn.execute(
-                "SELECT * FROM gfs_orders WHERE id = ?",
-                (order_id,)
-            )
-            order = cursor.fetchone()
-            if not order:
-                return None
-            
-            order_dict = dict(order)
-            
-            # Get order items with product details
-            cursor = conn.execute("""
-                SELECT oi.*, p.gfs_item_code, p.description, p.brand, 
-                       p.pack_size, p.unit_price, p.category_name
-                FROM gfs_order_items oi
-                JOIN gfs_products p ON oi.product_id = p.id
-                WHERE oi.order_id = ?
-            """, (order_id,))
-            
-            order_dict['items'] = [dict(row) for row in cursor.fetchall()]
-            return order_dict
+        conn = self.get_connection()
+        cursor = conn.execute(
+            "SELECT * FROM gfs_orders WHERE id = ?",
+            (order_id,)
+        )
+        order = cursor.fetchone()
+        if not order:
+            return None
+        
+        order_dict = dict(order)
+        
+        # Get order items with product details
+        cursor = conn.execute("""
+            SELECT oi.*, p.gfs_item_code, p.description, p.brand,
+                   p.pack_size, p.category_name
+            FROM gfs_order_items oi
+            JOIN gfs_products p ON oi.product_id = p.id
+            WHERE oi.order_id = ?
+        """, (order_id,))
+        
+        order_dict['items'] = [dict(row) for row in cursor.fetchall()]
+        return order_dict
     
     def get_orders(self, status=None, limit=20):
         """Get list of orders"""
-        with self.get_connection() as conn:
-            sql = "SELECT * FROM gfs_orders"
-            params = []
-            
-            if status:
-                sql += " WHERE status = ?"
-                params.append(status)
-            
-            sql += " ORDER BY created_date DESC LIMIT ?"
-            params.append(limit)
-            
-            cursor = conn.execute(sql, params)
-            return [dict(row) for row in cursor.fetchall()]
+        conn = self.get_connection()
+        sql = "SELECT * FROM gfs_orders"
+        params = []
+        
+        if status:
+            sql += " WHERE status = ?"
+            params.append(status)
+        
+        sql += " ORDER BY created_date DESC LIMIT ?"
+        params.append(limit)
+        
+        cursor = conn.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
     
-    def add_order_item(self, order_id, product_id, quantity=1, programs=None, notes=None):
+    def add_order_item(self, order_id, product_id, quantity=1, programs=None, notes=None, conn=None):
         """Add an item to an order"""
         programs_json = json.dumps(programs) if programs else None
         
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                INSERT INTO gfs_order_items (order_id, product_id, quantity, programs, notes)
-                VALUES (?, ?, ?, ?, ?)
-            """, (order_id, product_id, quantity, programs_json, notes))
-            conn.commit()
-            
-            self._update_order_total(order_id)
-            return cursor.lastrowid
+        # Priced at the product's current price; the gfs_order_items
+        # triggers add it to the order total
+        if conn is None:
+            conn = self.get_connection()
+        cursor = conn.execute("""
+            INSERT INTO gfs_order_items (order_id, product_id, quantity, unit_price, programs, notes)
+            VALUES (?, ?, ?, (SELECT unit_price FROM gfs_products WHERE id = ?), ?, ?)
+            RETURNING id
+        """, (order_id, product_id, quantity, product_id, programs_json, notes))
+        return cursor.fetchone()[0]
     
-    def update_order_item(self, item_id, quantity=None, programs=None, notes=None):
+    def update_order_item(self, item_id, quantity=None, programs=None, notes=None, conn=None):
         """Update an order item"""
-        with self.get_connection() as conn:
-            # Get order_id first
-            cursor = conn.execute(
-                "SELECT order_id FROM gfs_order_items WHERE id = ?",
-                (item_id,)
-            )
-            row = cursor.fetchone()
-            if not row:
-                return False
-            
-            order_id = row['order_id']
-            
-            if quantity is not None:
-                conn.execute(
-                    "UPDATE gfs_order_items SET quantity = ? WHERE id = ?",
-                    (quantity, item_id)
-                )
-            
-            if programs is not None:
-                conn.execute(
-                    "UPDATE gfs_order_items SET programs = ? WHERE id = ?",
-                    (json.dumps(programs), item_id)
-                )
-            
-            if notes is not None:
-                conn.execute(
-                    "UPDATE gfs_order_items SET notes = ? WHERE id = ?",
-                    (notes, item_id)
-                )
-            
-            conn.commit()
-            self._update_order_total(order_id)
-            return True
+        programs_json = json.dumps(programs) if programs is not None else None
+        
+        if conn is None:
+            conn = self.get_connection()
+        # Only overwrite the fields that were passed in
+        cursor = conn.execute("""
+            UPDATE gfs_order_items SET
+                quantity = COALESCE(?, quantity),
+                programs = COALESCE(?, programs),
+                notes = COALESCE(?, notes)
+            WHERE id = ?
+        """, (quantity, programs_json, notes, item_id))
+        return cursor.rowcount > 0
     
-    def remove_order_item(self, item_id):
+    def remove_order_item(self, item_id, conn=None):
         """Remove an item from an order"""
-        with self.get_connection() as conn:
-            cursor = conn.execute(
-                "SELECT order_id FROM gfs_order_items WHERE id = ?",
-                (item_id,)
-            )
-            row = cursor.fetchone()
-            if not row:
-                return False
-            
-            order_id = row['order_id']
-            conn.execute("DELETE FROM gfs_order_items WHERE id = ?", (item_id,))
-            conn.commit()
-            
-            self._update_order_total(order_id)
-            return True
-    
-    def _update_order_total(self, order_id):
-        """Recalculate order total estimate"""
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                SELECT SUM(oi.quantity * p.unit_price) as total
-                FROM gfs_order_items oi
-                JOIN gfs_products p ON oi.product_id = p.id
-                WHERE oi.order_id = ?
-            """, (order_id,))
-            
-            row = cursor.fetchone()
-            total = row['total'] if row and row['total'] else 0
-            
-            conn.execute(
-                "UPDATE gfs_orders SET total_estimate = ? WHERE id = ?",
-                (total, order_id)
-            )
-            conn.commit()
+        if conn is None:
+            conn = self.get_connection()
+        cursor = conn.execute(
+            "DELETE FROM gfs_order_items WHERE id = ?",
+            (item_id,)
+        )
+        return cursor.rowcount > 0
     
-    def update_order_status(self, order_id, status):
+    def update_order_status(self, order_id, status, conn=None):
         """Update order status"""
-        with self.get_connection() as conn:
-            conn.execute(
-                "UPDATE gfs_orders SET status = ? WHERE id = ?",
-                (status, order_id)
-            )
-            conn.commit()
+        if conn is None:
+            conn = self.get_connection()
+        conn.execute(
+            "UPDATE gfs_orders SET status = ? WHERE id = ?",
+            (status, order_id)
+        )
     
-    def duplicate_order(self, order_id, new_name=None):
+    def duplicate_order(self, order_id, new_name=None, conn=None):
         """Duplicate an existing order as a new draft"""
-        with self.get_connection() as conn:
+        with self.transaction(conn) as conn:
             # Get original order
             cursor = conn.execute(
                 "SELECT * FROM gfs_orders WHERE id = ?",
@@ -323,76 +629,90 @@ class DatabaseManager:
             # Create new order
             name = new_name or f"Copy of {original['name']}"
             cursor = conn.execute("""
-                INSERT INTO gfs_orders (name, notes, status)
-                VALUES (?, ?, 'draft')
+                INSERT INTO gfs_orders (name, notes, status, total_estimate)
+                VALUES (?, ?, 'draft', 0)
             """, (name, original['notes']))
             new_order_id = cursor.lastrowid
             
-            # Copy items
-            cursor = conn.execute(
-                "SELECT * FROM gfs_order_items WHERE order_id = ?",
-                (order_id,)
-            )
-            for item in cursor.fetchall():
-                conn.execute("""
-                    INSERT INTO gfs_order_items (order_id, product_id, quantity, programs, notes)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (
-                    new_order_id,
-                    item['product_id'],
-                    item['quantity'],
-                    item['programs'],
-                    item['notes']
-                ))
+            # Copy items, priced at current product prices
+            conn.execute("""
+                INSERT INTO gfs_order_items (order_id, product_id, quantity, unit_price, programs, notes)
+                SELECT ?, oi.product_id, oi.quantity, p.unit_price, oi.programs, oi.notes
+                FROM gfs_order_items oi
+                LEFT JOIN gfs_products p ON p.id = oi.product_id
+                WHERE oi.order_id = ?
+                ORDER BY oi.id
+            """, (new_order_id, order_id))
             
-            conn.commit()
-            self._update_order_total(new_order_id)
             return new_order_id
     
     # Invoice History Operations
-    def add_invoice(self, invoice_info):
+    def add_invoice(self, invoice_info, conn=None):
         """Add an invoice record"""
-        with self.get_connection() as conn:
-            cursor = conn.execute("""
-                INSERT OR IGNORE INTO gfs_invoice_history 
-                (invoice_number, invoice_date, location, total_amount)
-                VALUES (?, ?, ?, ?)
-            """, (
-                invoice_info.get('number'),
-                invoice_info.get('date'),
-                invoice_info.get('location'),
-                invoice_info.get('total')
-            ))
-            conn.commit()
-            return cursor.lastrowid
+        if conn is None:
+            conn = self.get_connection()
+        cursor = conn.execute("""
+            INSERT OR IGNORE INTO gfs_invoice_history
+            (invoice_number, invoice_date, location, total_amount)
+            VALUES (?, ?, ?, ?)
+        """, (
+            invoice_info.get('number'),
+            invoice_info.get('date'),
+            invoice_info.get('location'),
+            invoice_info.get('total')
+        ))
+        # lastrowid is connection-wide, so it is stale when the insert was ignored
+        return cursor.lastrowid if cursor.rowcount else 0
     
-    def add_invoice_item(self, invoice_id, product_id, item_data):
+    def add_invoice_item(self, invoice_id, product_id, item_data, conn=None):
         """Add an item to an invoice"""
-        with self.get_connection() as conn:
-            conn.execute("""
-                INSERT INTO gfs_invoice_items 
+        if conn is None:
+            conn = self.get_connection()
+        conn.execute("""
+            INSERT INTO gfs_invoice_items
+            (invoice_id, product_id, quantity, unit_price, extended_price)
+            VALUES (?, ?, ?, ?, ?)
+        """, (
+            invoice_id,
+            product_id,
+            item_data.get('quantity_shipped'),
+            item_data['unit_price'],
+            item_data['extended_price']
+        ))
+    
+    def add_invoice_items(self, invoice_id, items, product_ids, conn=None):
+        """Add all line items of an invoice, given item_code -> product_id"""
+        with self.transaction(conn) as conn:
+            conn.executemany("""
+                INSERT INTO gfs_invoice_items
                 (invoice_id, product_id, quantity, unit_price, extended_price)
                 VALUES (?, ?, ?, ?, ?)
-            """, (
-                invoice_id,
-                product_id,
-                item_data.get('quantity_shipped'),
-                item_data['unit_price'],
-                item_data['extended_price']
-            ))
-            conn.commit()
+            """, [
+                (
+                    invoice_id,
+                    product_ids[item['item_code']],
+                    item.get('quantity_shipped'),
+                    item['unit_price'],
+                    item['extended_price']
+                )
+                for item in items
+            ])
     
     # Program Operations
     def get_programs(self, active_only=True):
         """Get all programs"""
-        with self.get_connection() as conn:
-            sql = "SELECT * FROM gfs_programs"
-            if active_only:
-                sql += " WHERE is_active = 1"
-            sql += " ORDER BY category, name"
-            
-            cursor = conn.execute(sql)
-            return [dict(row) for row in cursor.fetchall()]
+        return self._cached(('get_programs', active_only),
+                            lambda: self._get_programs(active_only))
+    
+    def _get_programs(self, active_only):
+        conn = self.get_connection()
+        sql = "SELECT * FROM gfs_programs"
+        if active_only:
+            sql += " WHERE is_active = 1"
+        sql += " ORDER BY category, name"
+        
+        cursor = conn.execute(sql)
+        return [dict(row) for row in cursor.fetchall()]
     
     def get_programs_by_category(self):
         """Get programs grouped by category"""
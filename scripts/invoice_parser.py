@@ -6,7 +6,8 @@ Extracts product catalog from historical GFS invoices
 import pdfplumber
 import re
 import json
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from pathlib import Path
 
 # Category mapping from invoice codes
@@ -30,64 +31,39 @@ KNOWN_BRANDS = {
     'Packer', 'Tru Fru', 'Amafru', 'Ken\'s', 'G.S.', 'Zee Ze'
 }
 
-def extract_price_fields(parts):
-    """Extract the three price fields from the end of the line parts"""
-    # Look for decimal numbers at the end
-    prices = []
-    for p in reversed(parts):
-        if re.match(r'^\d+\.\d{2}$', p):
-            prices.insert(0, float(p))
-        elif prices:  # Stop when we hit non-price after finding prices
-            break
-    
-    if len(prices) >= 3:
-        return prices[-3], prices[-2], prices[-1]  # inv_val, unit_price, extended
-    elif len(prices) >= 2:
-        return 0.0, prices[-2], prices[-1]
-    elif len(prices) >= 1:
-        return 0.0, prices[-1], prices[-1]
-    return 0.0, 0.0, 0.0
+# Compiled once; these run for every invoice line
+# Item line: code, qty ordered, qty shipped, unit, pack/brand/description,
+# category, invoice value, unit price, extended price
+LINE_RE = re.compile(
+    r'(\d{6})\s+(\d+)\s+(\d+)\s+(\S+)\s+(.+?)\s+([A-Z]{2})'
+    r'\s+(\d+\.\d{2})\s+(\d+\.\d{2})\s+(\d+\.\d{2})\Z'
+)
+INVOICE_NUMBER_RE = re.compile(r'Invoice\s+(\d+)')
+INVOICE_DATE_RE = re.compile(r'Invoice Date\s+(\d{2}/\d{2}/\d{4})')
+LOCATION_RE = re.compile(r'([A-Z][A-Z\s]+(?:SCHOOL|ELEMENTARY|CENTER))')
+
+CATEGORY_SET = frozenset(CATEGORY_MAP)
+
+# Tokens that mark the end of the pack size
+PACK_UNITS = frozenset({'EA', 'LB', 'OZ', 'FOZ', 'CO', 'CS'})
 
 def parse_line_item(line):
     """Parse a single invoice line item"""
-    parts = line.strip().split()
-    if len(parts) < 8:
+    line = line.strip()
+    m = LINE_RE.match(line)
+    if not m:
         return None
     
-    # Must start with 6-digit item code
-    if not re.match(r'^\d{6}$', parts[0]):
-        return None
-    
-    item_code = parts[0]
-    
-    # Extract prices from the end
-    inv_val, unit_price, extended = extract_price_fields(parts)
+    (item_code, qty_ordered, qty_shipped, unit, middle,
+     category, inv_val, unit_price, extended) = m.groups()
     
-    # Find category code (2-letter code before the prices)
-    category = None
-    category_idx = None
-    for i in range(len(parts) - 4, max(4, len(parts) - 10), -1):
-        if i >= 0 and parts[i] in CATEGORY_MAP:
-            category = parts[i]
-            category_idx = i
-            break
-    
-    if not category:
-        return None
-    
-    # Quantity fields are usually positions 1 and 2
-    try:
-        qty_ordered = int(parts[1])
-        qty_shipped = int(parts[2])
-    except ValueError:
+    # Category is the 2-letter code right before the prices
+    if category not in CATEGORY_SET:
         return None
     
-    # Unit is position 3 (CS, EA, etc)
-    unit = parts[3] if len(parts) > 3 else 'CS'
-    
     # Everything between unit and category needs to be parsed
     # Format: PackSize [Brand] Description
-    middle_parts = parts[4:category_idx]
+    middle_parts = middle.split()
     
     # Try to identify pack size (usually contains 'x' or is numeric with unit)
     pack_size = ''
@@ -98,7 +74,7 @@ def parse_line_item(line):
         # Pack size usually has 'x' in it or is like "1x30 LB"
         pack_end = 0
         for i, part in enumerate(middle_parts):
-            if 'x' in part or part in ['EA', 'LB', 'OZ', 'FOZ', 'CO', 'CS']:
+            if 'x' in part or part in PACK_UNITS:
                 pack_end = i + 1
         
         pack_size = ' '.join(middle_parts[:pack_end])
@@ -115,20 +91,44 @@ def parse_line_item(line):
     
     return {
         'item_code': item_code,
-        'quantity_ordered': qty_ordered,
-        'quantity_shipped': qty_shipped,
+        'quantity_ordered': int(qty_ordered),
+        'quantity_shipped': int(qty_shipped),
         'unit': unit,
         'pack_size': pack_size,
         'brand': brand,
         'description': description,
         'category_code': category,
         'category_name': CATEGORY_MAP.get(category, category),
-        'invoice_value': inv_val,
-        'unit_price': unit_price,
-        'extended_price': extended,
-        'raw_line': line.strip()  # For debugging
+        'invoice_value': float(inv_val),
+        'unit_price': float(unit_price),
+        'extended_price': float(extended),
+        'raw_line': line  # For debugging
     }
 
+def page_lines(page, y_tolerance=3):
+    """Rebuild a page's text lines from its words, top to bottom
+    
+    Cheaper than page.extract_text(), which lays out the whole page; words
+    whose tops are within y_tolerance of the line's first word share a line.
+    """
+    words = sorted(page.extract_words(y_tolerance=y_tolerance), key=lambda w: w['top'])
+    
+    lines = []
+    line_words = []
+    line_top = None
+    for word in words:
+        if line_top is not None and word['top'] - line_top > y_tolerance:
+            lines.append(line_words)
+            line_words = []
+            line_top = None
+        if line_top is None:
+            line_top = word['top']
+        line_words.append(word)
+    if line_words:
+        lines.append(line_words)
+    
+    return [' '.join(w['text'] for w in sorted(ws, key=lambda w: w['x0'])) for ws in lines]
+
 def parse_invoice(pdf_path):
     """Parse a GFS invoice PDF and extract structured data"""
     items = []
@@ -136,36 +136,45 @@ def parse_invoice(pdf_path):
     
     with pdfplumber.open(pdf_path) as pdf:
         for page_num, page in enumerate(pdf.pages):
-            text = page.extract_text()
-            if not text:
-                continue
+            lines = page_lines(page)
             
-            lines = text.split('\n')
+            # Drop the page's cached layout objects once we have the text
+            page.flush_cache()
+            
+            if not lines:
+                continue
             
             # Extract invoice metadata from first page
             if page_num == 0:
                 for line in lines:
                     if 'Invoice' in line and not invoice_info.get('number'):
-                        m = re.search(r'Invoice\s+(\d+)', line)
+                        m = INVOICE_NUMBER_RE.search(line)
                         if m:
                             invoice_info['number'] = m.group(1)
                     
                     if 'Invoice Date' in line:
-                        m = re.search(r'Invoice Date\s+(\d{2}/\d{2}/\d{4})', line)
+                        m = INVOICE_DATE_RE.search(line)
                         if m:
-                            invoice_info['date'] = datetime.strptime(m.group(1), '%m/%d/%Y').date()
+                            # Fixed MM/DD/YYYY format; slicing avoids strptime
+                            mdy = m.group(1)
+                            invoice_info['date'] = date(int(mdy[6:10]), int(mdy[:2]), int(mdy[3:5]))
                     
                     if 'Ship To:' in line:
                         # Look ahead for location name
                         idx = lines.index(line)
                         for j in range(idx, min(idx+5, len(lines))):
-                            loc_match = re.search(r'([A-Z][A-Z\s]+(?:SCHOOL|ELEMENTARY|CENTER))', lines[j])
+                            loc_match = LOCATION_RE.search(lines[j])
                             if loc_match:
                                 invoice_info['location'] = loc_match.group(1).strip()
                                 break
             
             # Parse line items
             for line in lines:
+                # Cheap reject for headers, totals and blank lines:
+                # item lines start with a 6-digit code followed by a space
+                s = line.lstrip()
+                if len(s) < 7 or not s[:6].isdigit() or s[6] != ' ':
+                    continue
                 item = parse_line_item(line)
                 if item:
                     items.append(item)
@@ -179,42 +188,24 @@ def batch_process_invoices(invoice_dir, db_path):
     """
     Process all PDF invoices in a directory and build product catalog
     """
-    import sys
-    sys.path.insert(0, str(Path(__file__).parent))
-    from db_manager import DatabaseManager
+    if __package__:
+        from .db_manager import DatabaseManager
+    else:
+        # Run as a script, so this directory is already on sys.path
+        from db_manager import DatabaseManager
     
     db = DatabaseManager(db_path)
     invoice_files = sorted(Path(invoice_dir).glob('*_gfs_invoice.pdf'))
     
     print(f"Found {len(invoice_files)} invoice files")
     
-    for pdf_path in invoice_files:
-        print(f"\nProcessing: {pdf_path.name}")
-        try:
-            result = parse_invoice(str(pdf_path))
-            
-            if result['invoice_info']:
-                print(f"  Invoice: {result['invoice_info'].get('number')}")
-                print(f"  Date: {result['invoice_info'].get('date')}")
-                print(f"  Location: {result['invoice_info'].get('location')}")
-            
-            print(f"  Items found: {len(result['items'])}")
-            
-            # Store invoice and items
-            invoice_id = db.add_invoice(result['invoice_info'])
-            
-            for item in result['items']:
-                try:
-                    product_id = db.upsert_product(item)
-                    db.add_invoice_item(invoice_id, product_id, item)
-                except Exception as e:
-                    print(f"    Error storing item {item.get('item_code')}: {e}")
-                
-        except Exception as e:
-            print(f"  ERROR processing file: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+    # Parsing is CPU-bound and independent per file, so it runs in worker
+    # processes; results are stored in file order from this process.
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(parse_invoice, str(p)) for p in invoice_files]
+        
+        for pdf_path, future in zip(invoice_files, futures):
+            _store_parsed_invoice(db, pdf_path, future)
     
     print("\n" + "="*50)
     print("Processing complete!")
@@ -225,6 +216,34 @@ def batch_process_invoices(invoice_dir, db_path):
     for cat in stats:
         print(f"  {cat['category_name']}: {cat['count']} products")
 
+def _store_parsed_invoice(db, pdf_path, future):
+    """Store one parsed invoice and its items, printing progress"""
+    print(f"\nProcessing: {pdf_path.name}")
+    try:
+        result = future.result()
+        
+        if result['invoice_info']:
+            print(f"  Invoice: {result['invoice_info'].get('number')}")
+            print(f"  Date: {result['invoice_info'].get('date')}")
+            print(f"  Location: {result['invoice_info'].get('location')}")
+        
+        print(f"  Items found: {len(result['items'])}")
+        
+        # Store invoice and items in one transaction
+        try:
+            with db.transaction() as conn:
+                invoice_id = db.add_invoice(result['invoice_info'], conn=conn)
+                product_ids = db.bulk_upsert_products(result['items'], conn=conn)
+                db.add_invoice_items(invoice_id, result['items'], product_ids, conn=conn)
+        except Exception as e:
+            print(f"    Error storing items: {e}")
+    
+    except Exception as e:
+        print(f"  ERROR processing file: {e}")
+        import traceback
+        traceback.print_exc()
+
+
 if __name__ == '__main__':
     import sys
     